@@ -18,27 +18,208 @@ import io
 import logging
 import os
 import re
-from datetime import datetime
-
-import googleapiclient.discovery
+import threading
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from functools import lru_cache
+from time import monotonic, sleep
+from urllib.parse import urlparse
+
+import orjson
 import requests
-from bs4 import BeautifulSoup
-from bs4.element import ResultSet
 from dotenv import load_dotenv
-from googleapiclient.errors import HttpError
-from mutagen.mp3 import MP3
+from mutagen.mp3 import MP3, BitrateMode
+from requests.adapters import HTTPAdapter
+from requests_cache import DO_NOT_CACHE, CachedSession
+from requests_cache.backends.sqlite import SQLiteDict
+from selectolax.lexbor import LexborHTMLParser, LexborNode
+from urllib3.util.retry import Retry
 import mutagen  # don't delete needs for tests
 
 load_dotenv()
 key = os.getenv("api_key")
 
-datetime_format = "%Y-%m-%d %H:%M:%S"
-now = datetime.now().strftime(datetime_format)
-logging.basicConfig(
-    format="%(asctime)s %(message)s",
-    filename=f"{__name__}_{now}.log",
-    level=logging.ERROR,
-)
+# Episodes are scraped concurrently, the YouTube Data API is called
+# only for batches of video IDs, one at a time
+MAX_WORKERS = 20
+# The maximum number of IDs videos.list accepts in a single request
+YOUTUBE_BATCH_SIZE = 50
+YOUTUBE_VIDEOS_URL = "https://www.googleapis.com/youtube/v3/videos"
+
+# Every host gets its own token bucket, so bursts to different hosts
+# are independent of each other
+REQUESTS_PER_SECOND = 10
+
+
+class TokenBucket:
+    """A thread-safe token bucket refilled with `rate` tokens per second
+    and holding up to `capacity` tokens.
+
+    Args:
+        rate (float): The number of tokens added every second.
+        capacity (int): The maximum number of tokens, i.e. the size of a burst.
+    """
+
+    def __init__(self, rate: float, capacity: int) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Takes a token from the bucket, sleeping until it's refilled if empty.
+
+        The token is reserved under the lock and the wait happens outside of it,
+        so the waiting threads are queued one 1 / rate interval after another.
+        """
+        with self.lock:
+            current = monotonic()
+            elapsed = current - self.updated
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated = current
+            self.tokens -= 1
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0
+        if delay:
+            sleep(delay)
+
+
+class RateLimitedAdapter(HTTPAdapter):
+    """An HTTPAdapter sending at most REQUESTS_PER_SECOND requests
+    to every host. Responses served from the cache don't reach the adapter,
+    so they aren't limited.
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        self.buckets = {}
+        self.buckets_lock = threading.Lock()
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, *args, **kwargs):
+        host = urlparse(request.url).hostname
+        with self.buckets_lock:
+            bucket = self.buckets.setdefault(
+                host, TokenBucket(REQUESTS_PER_SECOND, REQUESTS_PER_SECOND)
+            )
+        bucket.acquire()
+        return super().send(request, *args, **kwargs)
+
+
+CACHE_NAME = "lex_podcast"
+
+
+@lru_cache(maxsize=1)
+def get_session() -> CachedSession:
+    """Returns the session every request is sent through, it's built on
+    the first call, so importing the module doesn't touch the disk.
+
+    One session is shared, so the TCP+TLS connections to the same hosts
+    (lexfridman.com, content.blubrry.com) are kept alive and reused.
+    The responses are cached on disk respecting Cache-Control/ETag headers,
+    so a re-run doesn't download unchanged pages again. MP3 bodies are too big
+    to be cached, their durations are stored in the "durations" table
+    of get_cache instead.
+
+    Returns:
+        A CachedSession with a RateLimitedAdapter mounted for http and https.
+    """
+    session = CachedSession(
+        CACHE_NAME,
+        use_cache_dir=True,
+        expire_after=timedelta(days=1),
+        cache_control=True,
+        allowable_codes=(200, 404),
+        urls_expire_after={"*.mp3": DO_NOT_CACHE},
+        ignored_parameters=("key",),
+    )
+    session.headers.update(
+        {
+            "User-Agent": "transcription-lex-podcast-parser",
+            "Accept-Encoding": "gzip, br",
+        }
+    )
+    # Every worker thread gets a kept-alive connection to every host, so
+    # concurrent requests never open throwaway connections over the pool size
+    adapter = RateLimitedAdapter(
+        pool_connections=20,
+        pool_maxsize=MAX_WORKERS,
+        # Throttling and transient server errors are retried with a backoff,
+        # the last response is returned as is so callers still check the status
+        max_retries=Retry(
+            total=3,
+            backoff_factor=0.3,
+            status_forcelist=(429, 500, 502, 503, 504),
+            raise_on_status=False,
+        ),
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+@lru_cache(maxsize=None)
+def get_cache(table_name: str) -> SQLiteDict:
+    """Returns a table of the on-disk cache the session uses, it's opened
+    on the first call. The "durations" table maps MP3 URLs to their durations
+    and the "upload_times" table maps YouTube video IDs to their upload times,
+    they never change, so the tables are kept without expiration.
+
+    Args:
+        table_name: The name of the table.
+
+    Returns:
+        A dict-like SQLiteDict stored in the user's cache directory.
+    """
+    return SQLiteDict(CACHE_NAME, table_name, use_cache_dir=True)
+
+
+# mutagen reads the duration from the Xing/VBRI/Info header in the first
+# frame, so only the beginning of an MP3 file is downloaded
+MP3_HEADER_BYTES = 256 * 1024
+# The audio kept after the ID3v2 tag in the first range, a few of the largest
+# MPEG frames, if there's less the range right after the tag is requested
+MP3_MIN_AUDIO_BYTES = 8 * 1024
+
+# (connect, read) timeouts in seconds: an unreachable host fails fast,
+# while a slow but responding server gets the time to send the body
+TIMEOUT = (3, 10)
+
+# A capture group instead of a lookbehind, and the fixed length of the ID
+# lets the engine fail fast on the URLs without it. The ID is matched in
+# watch?v=, youtu.be/ and /shorts/ links
+YOUTUBE_ID_PATTERN = re.compile(r"(?:v=|youtu\.be/|/shorts/)([A-Za-z0-9_-]{11})")
+
+logger = logging.getLogger(__name__)
+
+
+def fetch_episode_page(url: str) -> LexborHTMLParser | None:
+    """Retrieves and parses a Lex Fridman podcast episode page, so both
+    the description and the audio file URL are extracted from a single request.
+
+    The page is parsed with selectolax like the index page, the extractors
+    only need a couple of CSS selections.
+
+    Args:
+        url: A string representing the URL of the podcast episode page.
+
+    Returns:
+        A LexborHTMLParser tree of the podcast episode page,
+        or None if the page is not accessible.
+
+    Raises:
+        requests.exceptions.RequestException: if there is an error
+        retrieving the web page from the specified URL.
+    """
+    response = get_session().get(url, timeout=TIMEOUT)
+    if not response.ok:
+        logger.error(
+            "Provided URL: %s is not accessible,\n status code: %s",
+            url,
+            response.status_code,
+        )
+        return None
+    return LexborHTMLParser(response.content)
 
 
 def get_description(url: str) -> str:
@@ -56,38 +237,37 @@ def get_description(url: str) -> str:
         requests.exceptions.RequestException: if there is an error
         retrieving the web page from the specified URL.
     """
-    logging.info(
+    logger.info(
         "Retrieves the description text of a Lex Fridman podcast episode from: %s", url
     )
-    response = requests.get(url, timeout=5)
-    if not response.ok:
-        logging.exception(
-            "Provided URL: %s is not accessible,\n status code: %s",
-            url,
-            response.status_code,
-        )
+    tree = fetch_episode_page(url)
+    if tree is None:
         return ""
-    soup = BeautifulSoup(response.content, "html.parser")
+    return extract_description(tree)
+
+
+def extract_description(tree: LexborHTMLParser) -> str:
+    """Extracts the description text from a parsed podcast episode page.
+
+    Args:
+        tree: A LexborHTMLParser tree of the podcast episode page.
 
-    text_div = soup.find("div", {"class": "entry-content"})
+    Returns:
+        A string representing the description text of the podcast episode,
+        or an empty string if no description text is found.
+    """
+    text_div = tree.css_first("div.entry-content")
     try:
-        text = text_div.find_all("p")
+        text = text_div.css("p")
         if len(text) > 2:
-            if "Please" in text[2].text:
-                indx = text[2].text.index(" Please ")
-                result = text[2].text[:indx]
-                return result
-            result = text[2].text
-            return result
-        result = text_div.find("span").text
+            # The description is followed by a " Please support ..." plea,
+            # which is cut off in a single pass over the paragraph's text
+            description, _, _ = text[2].text().partition(" Please ")
+            return description
+        result = text_div.css_first("span").text()
         return result
     except Exception as error:
-        logging.exception(
-            "Provided URL: %s \nwith status code: %s \ncaused: %e",
-            url,
-            response.status_code,
-            error,
-        )
+        logger.error("Can't extract the description, caused: %s", error)
         return ""
 
 
@@ -98,7 +278,12 @@ def get_duration(mp3_url: str) -> float:
     The function returns length of an MP3 audio file in seconds to two decimal places.
     It raises an IOError if there is an I/O error while retrieving the MP3 audio file from mp3_url,
     and raises an MutagenError if there is an error while extracting metadata from
-    the MP3 audio file.
+    the MP3 audio file. Only the first MP3_HEADER_BYTES of the file are requested,
+    that is enough for mutagen to read the duration from the header frame.
+    If an ID3v2 tag (e.g. with a cover art) takes up that range, the same
+    number of bytes following the tag are requested instead.
+    Parsed durations are stored in the "durations" disk cache, so the file is
+    requested only once.
     If the provided link is not for an mp3 file, it logs an error and returns 0.
 
     Args:
@@ -113,101 +298,265 @@ def get_duration(mp3_url: str) -> float:
     """
     # Check if the provided URL has an mp3 file extension, else return 0
     if not mp3_url.lower().endswith(".mp3"):
-        logging.exception("Provided URL: %s does not point at an MP3 file", mp3_url)
+        logger.error("Provided URL: %s does not point at an MP3 file", mp3_url)
         return 0.0
 
+    # The duration of an already parsed file is taken from the disk cache
+    durations = get_cache("durations")
+    if mp3_url in durations:
+        return durations[mp3_url]
+
     try:
-        # Retrieve the MP3 audio file using the provided URL
-        response = requests.get(mp3_url, timeout=5)
+        # Retrieve only the head of the MP3 audio file, if the server ignores
+        # the Range header (200 instead of 206) the whole file is read
+        range_start = 0
+        response = get_mp3_range(mp3_url, range_start)
+
+        # The first frame lies past the range when the ID3v2 tag is too big,
+        # then the audio is requested from the end of the tag
+        tag_size = get_id3_size(response.content)
+        if (
+            response.status_code == requests.codes.partial_content
+            and len(response.content) == MP3_HEADER_BYTES
+            and tag_size + MP3_MIN_AUDIO_BYTES > MP3_HEADER_BYTES
+        ):
+            range_start = tag_size
+            response = get_mp3_range(mp3_url, range_start)
 
         # Read the MP3 audio file into a bytes buffer using io.BytesIO
         with io.BytesIO(response.content) as mp3_buffer:
             # Use mutagen to extract metadata from the MP3 audio file
             mp3 = MP3(mp3_buffer)
 
+            length = mp3.info.length
+            # Without a Xing/VBRI/Info header mutagen estimates the length from
+            # the size of the buffer, so extend it to the size of the whole file
+            if (
+                response.status_code == requests.codes.partial_content
+                and mp3.info.bitrate_mode == BitrateMode.UNKNOWN
+            ):
+                file_size = get_file_size(response)
+                if file_size:
+                    missing_bytes = file_size - range_start - len(response.content)
+                    length += 8 * missing_bytes / mp3.info.bitrate
+
             # Return the length of the MP3 audio file in seconds, rounded to 2 decimal places
-            return round(mp3.info.length, 2)
+            duration = round(length, 2)
+            durations[mp3_url] = duration
+            return duration
 
     except requests.exceptions.RequestException as error:
         # Log an error if there is a RequestException during retrieval
-        logging.exception("Error retrieving MP3 file from %s: %s", mp3_url, error)
+        logger.error("Error retrieving MP3 file from %s: %s", mp3_url, error)
         return 0.0
     except Exception as error:
         # Log any other exceptions raised during metadata extraction
-        logging.exception(
+        logger.error(
             "Error extracting metadata from MP3 file at %s: %s", mp3_url, error
         )
         return 0.0
 
 
+def get_mp3_range(mp3_url: str, start: int) -> requests.Response:
+    """Requests MP3_HEADER_BYTES of an MP3 file starting at the given offset.
+
+    Args:
+        mp3_url: URL of an MP3 audio file.
+        start: The offset of the first requested byte.
+
+    Returns:
+        The response, 206 with the range or 200 with the whole file
+        if the server ignores the Range header.
+    """
+    return get_session().get(
+        mp3_url,
+        headers={"Range": f"bytes={start}-{start + MP3_HEADER_BYTES - 1}"},
+        stream=True,
+        timeout=TIMEOUT,
+    )
+
+
+def get_id3_size(content: bytes) -> int:
+    """Returns the size of the ID3v2 tag at the beginning of an MP3 file.
+
+    The tag size is stored in bytes 6-9 of the tag header as a synchsafe
+    integer (7 bits per byte) and excludes the 10-byte header and the footer.
+
+    Args:
+        content: The beginning of an MP3 file.
+
+    Returns:
+        The number of bytes the tag takes including its header and footer,
+        or 0 if the file doesn't start with an ID3v2 tag.
+    """
+    if len(content) < 10 or content[:3] != b"ID3":
+        return 0
+    size = 0
+    for byte in content[6:10]:
+        size = size << 7 | byte & 0x7F
+    footer_size = 10 if content[5] & 0x10 else 0
+    return 10 + size + footer_size
+
+
+def get_file_size(response: requests.Response) -> int | None:
+    """Returns the size of the whole file a partial (206) response is a part of.
+
+    Args:
+        response: A response to a request with a Range header.
+
+    Returns:
+        The total size in bytes from the Content-Range header,
+        or None if the header is missing or the size is unknown ('*').
+    """
+    content_range = response.headers.get("Content-Range", "")
+    _, _, file_size = content_range.rpartition("/")
+    return int(file_size) if file_size.isdigit() else None
+
+
+def list_videos(video_ids: list, api_key: str) -> list:
+    """
+    Requests the snippets of the given videos from the videos.list endpoint
+    of the YouTube Data API.
+
+    The endpoint is called through get_session(), so the request shares the pooled
+    connections, the rate limiting and the HTTP cache with the rest of the
+    requests, and the response is decoded with orjson.
+
+    Args:
+        video_ids (list): Up to YOUTUBE_BATCH_SIZE 11-character video IDs.
+        api_key (str): A valid YouTube Data API key with the 'youtube.readonly' scope.
+
+    Returns:
+        A list of the video resources the API returned.
+
+    Raises:
+        requests.exceptions.RequestException: if the API call fails.
+    """
+    response = get_session().get(
+        YOUTUBE_VIDEOS_URL,
+        params={
+            "part": "snippet",
+            "id": ",".join(video_ids),
+            "key": api_key,
+        },
+        timeout=TIMEOUT,
+    )
+    response.raise_for_status()
+    return orjson.loads(response.content).get("items", [])
+
+
 def get_date_time(youtube_video_id: str, api_key: str) -> tuple:
     """
     Retrieves the date and time when a YouTube video was uploaded, given its
-    video ID and a valid YouTube Data API key.
+    video ID and a valid YouTube Data API key. It's a single-video shortcut
+    for get_upload_times.
 
     Args:
         youtube_video_id (str): The 11-character video ID of the desired YouTube video.
-        api_key
-     (str): A valid YouTube Data API key with the 'youtube.readonly' scope.
+        api_key (str): A valid YouTube Data API key with the 'youtube.readonly' scope.
 
     Returns:
-        A tuple containing the date and time when the video was uploaded on YouTube,
-        in the format 'YYYY-MM-DD HH:MM:SS'. If the video ID is invalid or the API call
-        fails, the function returns None.
+        A tuple containing the date and time when the video was uploaded on YouTube.
+        If the video ID is invalid or the API call fails, the function
+        returns (None, None).
     """
-    # Create a YouTube Data API client using the provided API key
     if not all(isinstance(argument, str) for argument in (youtube_video_id, api_key)):
-        logging.exception(
+        logger.error(
             "Some variable(s) in the input has a wrong type %s is %s api's type: %s fix the input",
             youtube_video_id,
             type(youtube_video_id),
             type(api_key),
         )
         return None, None
+    upload_times = get_upload_times([youtube_video_id], api_key)
+    return upload_times.get(youtube_video_id, (None, None))
 
-    youtube = googleapiclient.discovery.build("youtube", "v3", developerKey=key)
 
-    # Retrieve the video snippet using the video ID
-    request = youtube.videos().list(part="snippet", id=youtube_video_id)
-    response = request.execute()
+def get_upload_times(video_ids: list, api_key: str) -> dict:
+    """
+    Retrieves the dates and times when YouTube videos were uploaded, requesting
+    up to YOUTUBE_BATCH_SIZE video IDs in a single videos.list call, so N videos
+    cost N / 50 API calls instead of N. The upload times are stored in
+    the "upload_times" disk cache, so only the new videos are requested on a re-run.
 
-    # Extract the upload date and time from the video snippet
-    try:
-        upload_date = response["items"][0]["snippet"]["publishedAt"]
-        upload_date = upload_date.replace("Z", "+00:00")  # Convert to UTC time zone
-        upload_datetime = datetime.fromisoformat(upload_date)
-        upload_datetime_str = upload_datetime.strftime("%Y-%m-%d %H:%M:%S")
-        date_time = convert_to_timestamp(upload_datetime_str)
-        return date_time
-    except (KeyError, IndexError) as error:
-        # If the video ID is invalid or the API call fails, return None
-        logging.exception(
-            "Error retrieving upload time file with id %s to youtube: %s",
-            youtube_video_id,
-            error,
-        )
-        return None, None
-    except HttpError as error:
-        logging.exception(
-            "There is some problem with either the api key or with the Internet %s",
-            error,
-        )
-        return None, None
+    Args:
+        video_ids (list): The 11-character video IDs of the YouTube videos,
+        the ones that aren't strings are skipped.
+        api_key (str): A valid YouTube Data API key with the 'youtube.readonly' scope.
+
+    Returns:
+        A dict mapping each video ID to a tuple containing the date and time when
+        the video was uploaded on YouTube. The IDs the API doesn't know about
+        or the batches that failed are missing from the dict.
+    """
+    cached_upload_times = get_cache("upload_times")
+    upload_times = {}
+    missing_ids = []
+    for video_id in video_ids:
+        if not isinstance(video_id, str):
+            continue
+        if video_id in cached_upload_times:
+            upload_times[video_id] = cached_upload_times[video_id]
+        else:
+            missing_ids.append(video_id)
+
+    for start in range(0, len(missing_ids), YOUTUBE_BATCH_SIZE):
+        batch = missing_ids[start : start + YOUTUBE_BATCH_SIZE]
+        try:
+            items = list_videos(batch, api_key)
+        except (requests.exceptions.RequestException, orjson.JSONDecodeError) as error:
+            logger.error(
+                "There is some problem with either the api key or with the Internet %s",
+                error,
+            )
+            continue
+
+        # A malformed item only loses the upload time of its own video
+        for item in items:
+            try:
+                video_id = item["id"]
+                date_time = parse_published_at(item["snippet"]["publishedAt"])
+            except (KeyError, ValueError) as error:
+                logger.error("There is %s in the video item %s", error, item)
+                continue
+            upload_times[video_id] = cached_upload_times[video_id] = date_time
+    return upload_times
+
+
+def parse_published_at(published_at: str) -> tuple:
+    """
+    Convert the publishedAt value of a YouTube video snippet
+    to separate date and time objects in UTC.
+
+    Args:
+        published_at (str): A string in ISO 8601 format e.g. '2022-11-04T16:09:32Z'.
+
+    Returns:
+        A tuple containing the date and time when the video was uploaded.
+    """
+    published_at = published_at.replace("Z", "+00:00")  # Convert to UTC time zone
+    return convert_to_timestamp(datetime.fromisoformat(published_at))
 
 
-def convert_to_timestamp(date_str: str) -> tuple:
+def convert_to_timestamp(date_time: str | datetime) -> tuple:
     """
-    Convert a string representing a date and time in ISO 8601 format
-    to separate date and time objects.
+    Convert a datetime, or a string representing a date and time in ISO 8601
+    format, to separate date and time objects.
+
+    A datetime is split directly, a string is parsed with the C fast path of
+    datetime.fromisoformat, which is much faster than strptime. fromisoformat
+    accepts other ISO 8601 forms as well (week dates, UTC offsets, fractions
+    of a second), so only the strings the parsed datetime turns back into
+    are accepted, i.e. the 'YYYY-MM-DD HH:MM:SS' ones.
 
     Args:
-        date_str (str): A string representing a date and time in ISO 8601 format
-        e.g. '2022-11-04T16:09:32Z'.
+        date_time (str | datetime): A datetime or a string representing
+        a date and time in ISO 8601 format e.g. '2022-11-04 16:09:32'.
 
     Returns:
         A tuple containing two objects: a 'date' object representing
-        the date portion of the input string,
-        and a 'time' object representing the time portion of the input string.
+        the date portion of the input,
+        and a 'time' object representing the time portion of the input.
 
     Example:
         >>> convert_to_timestamp('2022-11-04 16:09:32')
@@ -215,22 +564,24 @@ def convert_to_timestamp(date_str: str) -> tuple:
     """
     try:
         # Parse the input string as a datetime object
-        timestamp = datetime.strptime(date_str, "%Y-%m-%d %H:%M:%S")
-        # Extract the date and time components from the datetime object
-        date = timestamp.date()
-        time = timestamp.time()
-        # Return the date and time components as a tuple
-        return date, time
-    except ValueError as error:
+        if isinstance(date_time, str):
+            parsed = datetime.fromisoformat(date_time)
+            if parsed.isoformat(" ") != date_time:
+                raise ValueError("expected the 'YYYY-MM-DD HH:MM:SS' format")
+            date_time = parsed
+        # Return the date and time components of the datetime object as a tuple
+        return date_time.date(), date_time.time()
+    except (ValueError, AttributeError) as error:
         # Raise an error if the input string is not in the expected format
-        logging.error("Invalid ISO 8601 format: %s: %s", date_str, error)
+        logger.error("Invalid ISO 8601 format: %s: %s", date_time, error)
         return 0, 0
 
 
 def get_youtube_id(youtube_url: str) -> str | None:
     """
-    Extracts the YouTube video ID from a YouTube URL in the format
-    'https://www.youtube.com/watch?v=XXXXXXXXXXX' and returns it as a string.
+    Extracts the YouTube video ID from a YouTube URL in one of the formats
+    'https://www.youtube.com/watch?v=XXXXXXXXXXX', 'https://youtu.be/XXXXXXXXXXX'
+    or 'https://www.youtube.com/shorts/XXXXXXXXXXX' and returns it as a string.
 
     Args:
         youtube_url (str): A string containing a valid YouTube video URL.
@@ -241,7 +592,7 @@ def get_youtube_id(youtube_url: str) -> str | None:
     """
     # Validate the input
     if not isinstance(youtube_url, str):
-        logging.error(
+        logger.error(
             "Wrong format of the url %s, it should be <class 'str'> not %s",
             youtube_url,
             type(youtube_url),
@@ -249,24 +600,28 @@ def get_youtube_id(youtube_url: str) -> str | None:
         return None
 
     # Search for the video ID in the URL using a regular expression
-    match = re.search(r"(?<=v=)[\w-]+", youtube_url)
+    match = YOUTUBE_ID_PATTERN.search(youtube_url)
 
     # If a match is found, extract the video ID from the match object
     if match:
-        video_id = match.group(0)
+        video_id = match.group(1)
         return video_id
 
     # If no match is found add the info to the logging, and return None
-    logging.error(
+    logger.error(
         "Can't extract the video ID from the match object from the url %s", youtube_url
     )
     return None
 
 
 def check_url_response(url: str) -> str | None:
-    """Send an HTTP GET request to the given URL and return the URL
+    """Send an HTTP HEAD request to the given URL and return the URL
     if the response status code is 200 OK.
 
+    Only the status line is needed, so HEAD avoids downloading the body
+    (tens of MB for an MP3). If the server refuses HEAD the check falls back
+    to a streamed GET, which is closed without reading the body.
+
     Args:
         url: A string representing the URL to request.
 
@@ -274,10 +629,13 @@ def check_url_response(url: str) -> str | None:
         If the response status code is 200 OK, return the input URL.
         Otherwise, return None.
     """
-    response = requests.get(url, timeout=10)
+    response = get_session().head(url, allow_redirects=True, timeout=TIMEOUT)
+    if response.status_code == requests.codes.method_not_allowed:
+        with get_session().get(url, stream=True, timeout=TIMEOUT) as response:
+            pass
     if response.status_code == requests.codes.ok:
         return url
-    logging.error("The url %s responce code is %s", url, response.status_code)
+    logger.error("The url %s responce code is %s", url, response.status_code)
     return None
 
 
@@ -292,33 +650,46 @@ def get_audio_file_url(podcast_url: str) -> str | None:
         A string containing the URL of the audio file, or None if the URL cannot be retrieved.
     """
     try:
-        response = requests.get(podcast_url, timeout=5)
+        tree = fetch_episode_page(podcast_url)
     except requests.exceptions.RequestException as error:
-        logging.error(
-            "The url %s responce code is %s. Error: %s.",
-            podcast_url,
-            response.status_code,
-            error,
-        )
+        logger.error("The url %s is not accessible. Error: %s.", podcast_url, error)
+        return None
+    if tree is None:
         return None
+    return extract_audio_file_url(tree)
 
-    soup = BeautifulSoup(response.content, "html.parser")
-    try:
-        audio_file_url = soup.find("a", {"class": "powerpress_link_pinw"})["href"]
-        return check_url_response(audio_file_url)
-    except TypeError as error:
-        logging.error("The url %s is incorrect. Error: %s.", podcast_url, error)
+
+def extract_audio_file_url(tree: LexborHTMLParser) -> str | None:
+    """
+    Extracts the URL of the audio file from a parsed podcast episode page
+    and checks that it's accessible.
+
+    Args:
+        tree: A LexborHTMLParser tree of the podcast episode page.
+
+    Returns:
+        A string containing the URL of the audio file, or None if the URL cannot be retrieved.
+    """
+    link = tree.css_first("a.powerpress_link_pinw[href]")
+    if link is None:
+        logger.error("There is no audio file link on the page.")
         return None
+    return check_url_response(link.attributes["href"])
 
 
-def get_data() -> set | None:
+def get_data() -> list | None:
     """
     Retrieves podcast episode data from "https://lexfridman.com/podcast/"
 
+    The page lists hundreds of episodes, so it's parsed with selectolax
+    which is several times faster than BeautifulSoup for CSS selection,
+    and every episode's fields are extracted by parse_episode in a single pass
+    over the tree.
+
     Returns:
-        bs4.element.ResultSet
-        A set of tuples, where each tuple contains the metadata for
-        a single podcast episode.
+        list[dict]
+        A list of the episodes found on the index page as returned by
+        parse_episode, parse_the_data turns each one into a tuple.
         The tuples are structured as follows:
             - title (str): the title of the episode.
             - guest (str): the name of the guest featured in the episode.
@@ -332,23 +703,47 @@ def get_data() -> set | None:
     """
     url = "https://lexfridman.com/podcast/"
     try:
-        response = requests.get(url, timeout=5)
+        response = get_session().get(url, timeout=TIMEOUT)
+        response.raise_for_status()
     except requests.exceptions.RequestException as error:
-        logging.error(
-            "The url %s responce code is %s. Error: %s.",
-            url,
-            response.status_code,
-            error,
-        )
+        logger.error("The url %s is not accessible. Error: %s.", url, error)
         return None
 
-    soup = BeautifulSoup(response.content, "html.parser")
+    tree = LexborHTMLParser(response.content)
+
+    episodes = map(parse_episode, tree.css("div.guest"))
+    return [episode for episode in episodes if episode is not None]
 
-    episodes = soup.find_all("div", {"class": "guest"})
-    return episodes
+
+def parse_episode(episode: LexborNode) -> dict | None:
+    """Extracts the fields of the given episode listed on the index page,
+    each selector runs once per episode and the rest of the pipeline
+    works with plain strings.
+
+    Args:
+        episode: selectolax.lexbor.LexborNode: The episode to parse
+
+    Returns:
+        A dict with the title, guest, youtube_url, podcast_page and
+        thumbnail_url of the episode or None if some of them are missing.
+    """
+    try:
+        youtube_url, podcast_page = [
+            link.attributes["href"] for link in episode.css("div.vid-materials a")[:2]
+        ]
+        return {
+            "title": episode.css_first(".vid-title a").text(),
+            "guest": episode.css_first(".vid-person").text(),
+            "youtube_url": youtube_url,
+            "podcast_page": podcast_page,
+            "thumbnail_url": episode.css_first(".thumb-youtube img").attributes["src"],
+        }
+    except Exception as error:
+        logger.error("There is %s in %s", error, episode.text())
+        return None
 
 
-def parse_the_data(episode: ResultSet) -> tuple:
+def parse_the_data(episode: dict) -> tuple:
     """Parses the data for the given episode and returns a tuple containing
     the following data:
     - Title of the episode
@@ -358,11 +753,11 @@ def parse_the_data(episode: ResultSet) -> tuple:
     - YouTube URL of the episode
     - Audio file URL of the episode
     - Thumbnail URL of the episode
-    - Date of the episode
-    - Time of the episode
+    - Date of the episode, None until it's filled by add_upload_time
+    - Time of the episode, None until it's filled by add_upload_time
 
     Args:
-    - episode: bs4.element.ResultSet: The episode to parse
+    - episode: dict: The episode to parse as returned by parse_episode
 
     Returns:
     - tuple | None: A tuple containing the data for the episode or None
@@ -370,17 +765,18 @@ def parse_the_data(episode: ResultSet) -> tuple:
     """
 
     try:
-        youtube_url, podcast_page = [
-            link["href"] for link in episode.select("div.vid-materials a")[:2]
-        ]
-        title = episode.select_one(".vid-title a").text
-        guest = episode.select_one(".vid-person").text
-        thumbnail_url = episode.select_one(".thumb-youtube img")["src"]
-        description = get_description(podcast_page)
-        audio_file_url = get_audio_file_url(podcast_page)
+        title = episode["title"]
+        guest = episode["guest"]
+        youtube_url = episode["youtube_url"]
+        podcast_page = episode["podcast_page"]
+        thumbnail_url = episode["thumbnail_url"]
+        episode_page = fetch_episode_page(podcast_page)
+        if episode_page is None:
+            description, audio_file_url = "", None
+        else:
+            description = extract_description(episode_page)
+            audio_file_url = extract_audio_file_url(episode_page)
         duration = get_duration(audio_file_url)
-        youtube_video_id = get_youtube_id(youtube_url)
-        date, time = get_date_time(youtube_video_id, key)
         record = (
             title,
             guest,
@@ -389,21 +785,43 @@ def parse_the_data(episode: ResultSet) -> tuple:
             youtube_url,
             audio_file_url,
             thumbnail_url,
-            date,
-            time,
+            None,
+            None,
         )
         return record
     except Exception as error:
-        logging.error("There is %s in %s", error, episode.text)
+        logger.error("There is %s in %s", error, episode)
         return tuple(None for _ in range(9))
 
 
-def save_list_to_csv(data: set, file_name: str) -> None:
+def add_upload_time(record: tuple, upload_times: dict) -> tuple:
+    """Fills the date and time of a record returned by parse_the_data
+    with the upload time of its YouTube video.
+
+    Args:
+    - record: tuple: The data of the episode returned by parse_the_data
+    - upload_times: dict: The upload dates and times of the videos
+    returned by get_upload_times
+
+    Returns:
+    - tuple: The record with the date and time of the episode, the records
+    of the episodes that failed to parse are returned unchanged
+    """
+    if all(field is None for field in record):
+        return record
+    youtube_video_id = get_youtube_id(record[4])
+    return record[:7] + upload_times.get(youtube_video_id, (None, None))
+
+
+def save_list_to_csv(data: Iterable, file_name: str) -> None:
     """Write the data to a CSV file with the given file_name.
 
+    The rows are written and flushed one by one as they come from data,
+    so a generator is never buffered and a crash keeps the rows written so far.
+
     Args:
-        data: A list of tuples, where the first tuple is a header and
-        each next tuple represents a row in the CSV file.
+        data: An iterable of tuples, where each tuple represents a row
+        in the CSV file, the header is written by the function.
         file_name: A string representing the file_name for the output CSV file.
     """
     with open(f"{file_name}.csv", "w", newline="", encoding="UTF-8") as file:
@@ -423,28 +841,69 @@ def save_list_to_csv(data: set, file_name: str) -> None:
         )
         writer.writerow(header)
 
-        # Write data rows
-        for row in data:
-            if all(isinstance(field, type(None)) for field in row):
-                continue
-            if not isinstance(row, tuple):
-                try:
-                    row = tuple(row)
-                    writer.writerow(row)
-                except Exception as error:
-                    logging.error("There is %s in %s", error, row)
+        # Write data rows, skipping the records of the episodes that failed
+        rows = (row for row in data if any(field is not None for field in row))
+        for row in rows:
             writer.writerow(row)
+            file.flush()
+
+
+def iter_data() -> Iterator[tuple]:
+    """Retrieves all the podcast episodes from the Lex Fridman podcast webpage
+    with the get_data function and yields the metadata of every episode
+    as soon as it's parsed.
+
+    The work is split into stages: the video IDs are taken from the index page,
+    then the batched get_upload_times lookup runs alongside the episode pages,
+    which are parsed concurrently by parse_the_data in a pool of MAX_WORKERS
+    threads since the work is dominated by the network latency, so the total
+    time is the longest stage rather than their sum. The upload times are merged
+    into the records by add_upload_time.
+
+    The records are yielded in the order the episodes finish, not in the order
+    they're listed, so one slow episode page or MP3 doesn't hold back the rows
+    of the episodes already parsed.
+
+    The episodes listed more than once are skipped before any page is fetched,
+    they're told apart by the 11-character YouTube video ID rather than by
+    the whole record, the episodes without one are told apart by their page.
+
+    Yields:
+        tuple: The metadata of an episode as returned by add_upload_time.
+    """
+    # The session and the cache tables are opened before the pool starts,
+    # so the worker threads share them instead of racing to build their own
+    get_session()
+    for table_name in ("durations", "upload_times"):
+        get_cache(table_name)
+
+    unique_episodes = {}
+    for episode in get_data() or []:
+        video_id = get_youtube_id(episode["youtube_url"])
+        unique_episodes.setdefault(
+            video_id or episode["podcast_page"], (video_id, episode)
+        )
+    video_ids = [video_id for video_id, _ in unique_episodes.values()]
+    episodes = [episode for _, episode in unique_episodes.values()]
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        upload_times = executor.submit(get_upload_times, video_ids, key)
+        futures = [executor.submit(parse_the_data, episode) for episode in episodes]
+        for future in as_completed(futures):
+            yield add_upload_time(future.result(), upload_times.result())
 
 
 def main() -> None:
-    """Calls the get_data function to retrieve all the podcast episodes
-    from the Lex Fridman podcast webpage and passes each episode to the parse_the_data
-    function to extract the relevant metadata for the podcast. Finally, it writes
-    the retrieved metadata to a CSV file using the save_list_to_csv function.
-    """
-    episodes = get_data()
-    data_list = set(map(parse_the_data, episodes))
-    save_list_to_csv(data_list, "temp")
+    """Configures logging to a timestamped file and writes the metadata of
+    all the podcast episodes yielded by iter_data to a CSV file using
+    the save_list_to_csv function row by row.
+    """
+    # The name has no spaces or colons, so it's valid on every OS
+    logging.basicConfig(
+        format="%(asctime)s %(message)s",
+        filename=f"lex_podcast_{datetime.now():%Y%m%d_%H%M%S}.log",
+        level=logging.ERROR,
+    )
+    save_list_to_csv(iter_data(), "temp")
 
 
 if __name__ == "__main__":
@@ -3,15 +3,26 @@ Test Cases for lex_podcast.py
 """
 import csv
 import datetime
+import os
 import random
+import tempfile
 from unittest import TestCase
-from unittest.mock import Mock, patch
+from unittest.mock import MagicMock, Mock, patch
 
+import orjson
 import requests
 
 from parsing import lex_podcast
 
-PODCASTS_DATA = {}
+# The fixtures are read once when the module is imported,
+# every test only samples them
+with open("tests/fixtures/test_data.csv", encoding="UTF-8") as csv_data:
+    reader = csv.reader(csv_data, delimiter=";")
+    header = next(reader)
+    PODCASTS_DATA = tuple(dict(zip(header, row)) for row in reader)
+
+with open("tests/fixtures/fake_mp3_bytes.txt", "rb") as fake_mp3:
+    FAKE_MP3 = fake_mp3.readline()
 
 
 class TestLexPodcastParser(TestCase):
@@ -19,19 +30,29 @@ class TestLexPodcastParser(TestCase):
 
     @classmethod
     def setUpClass(cls) -> None:
-        """Load test_data responses needed by tests"""
-        global PODCASTS_DATA
-        with open("tests/fixtures/test_data.csv", encoding="UTF-8") as csv_data:
-            reader = csv.reader(csv_data, delimiter=";")
-            PODCASTS_DATA = list(reader)
+        """Patch the HTTP session once for the whole class, every test
+        sets the responses it needs on the mocks"""
+        session_patcher = patch.object(lex_podcast, "get_session")
+        session = session_patcher.start().return_value
+        cls.addClassCleanup(session_patcher.stop)
+        cls.mock_get = session.get
+        cls.mock_head = session.head
 
     def setUp(self) -> None:
-        # if this value ever changes with the name of corresponding folders
-        #  don't forget to change it in @path which are patch the same 
-        self.request_get = "parsing.lex_podcast.requests.get"
-        self.podcast = dict(zip(PODCASTS_DATA[0], random.choice(PODCASTS_DATA[1:])))
-        with open("tests/fixtures/fake_mp3_bytes.txt", "rb") as fake_mp3:
-            self.fake_mp3 = fake_mp3.readlines()[0]
+        # the session mocks are shared, so start every test with clean ones
+        for session_mock in (self.mock_get, self.mock_head):
+            session_mock.reset_mock(return_value=True, side_effect=True)
+        # don't let the tests read or fill the on-disk caches
+        self.caches = {}
+        cache_patcher = patch.object(
+            lex_podcast,
+            "get_cache",
+            side_effect=lambda table_name: self.caches.setdefault(table_name, {}),
+        )
+        cache_patcher.start()
+        self.addCleanup(cache_patcher.stop)
+        self.podcast = random.choice(PODCASTS_DATA)
+        self.fake_mp3 = FAKE_MP3
 
     ######################################################################
     #  T E S T   C A S E S
@@ -45,12 +66,25 @@ class TestLexPodcastParser(TestCase):
         self.assertEqual(
             lex_podcast.convert_to_timestamp(date_str), (expected_date, expected_time)
         )
+        date_time = datetime.datetime(2022, 11, 4, 16, 9, 32)
+        self.assertEqual(
+            lex_podcast.convert_to_timestamp(date_time), (expected_date, expected_time)
+        )
 
     def test_convert_to_timestamp_with_a_sad_path(self):
         """Test convert_to_timestamp function with an invalid input"""
         date_str = "2022-11-04T16:09:32Z"
         self.assertEqual(lex_podcast.convert_to_timestamp(date_str), (0, 0))
         self.assertEqual(lex_podcast.convert_to_timestamp(""), (0, 0))
+        self.assertEqual(lex_podcast.convert_to_timestamp(None), (0, 0))
+        # other ISO 8601 forms fromisoformat accepts are rejected as well
+        for date_str in (
+            "2022-W44-5 16:09:32",
+            "2022-11-04 16:09+01",
+            "2022-11-04 16:09:32.5",
+            "20221104 160932",
+        ):
+            self.assertEqual(lex_podcast.convert_to_timestamp(date_str), (0, 0))
 
     def test_get_youtube_id_with_a_valid_link(self):
         """Test get_youtube_id with a valid link"""
@@ -59,6 +93,15 @@ class TestLexPodcastParser(TestCase):
         valid_id = valid_url[-11:]
         self.assertEqual(youtube_id, valid_id)
 
+    def test_get_youtube_id_with_short_links(self):
+        """Test get_youtube_id with youtu.be and shorts links"""
+        video_id = self.podcast["youtube_url"][-11:]
+        for url in (
+            f"https://youtu.be/{video_id}",
+            f"https://www.youtube.com/shorts/{video_id}?feature=share",
+        ):
+            self.assertEqual(lex_podcast.get_youtube_id(url), video_id)
+
     def test_get_youtube_id_half_a_valid_link(self):
         """Test get_youtube_id with a half valid link"""
         invalid_url = "cseicjahcdc" + self.podcast["youtube_url"]
@@ -77,77 +120,277 @@ class TestLexPodcastParser(TestCase):
         invalid_url = None
         self.assertIsNone(lex_podcast.get_youtube_id(invalid_url))
 
-    @patch("googleapiclient.discovery.build")
-    def test_get_date_time_with_a_valid_input(self, mock_build):
+    def test_get_date_time_with_a_valid_input(self):
         """Test get_date_time with a valid input"""
         youtube_video_id = "abcde123456"
         api_key = "secretapikey"
 
-        with patch.object(lex_podcast, "convert_to_timestamp") as mock_convert:
-            # Mock the API response
-            mock_response = {
-                "items": [{"snippet": {"publishedAt": "2023-06-15T13:45:30Z"}}]
-            }
-
-            date_time = datetime.datetime(2023, 6, 15, 13, 45, 30)
-            # Configure the mock object
-            mock_request = mock_build.return_value.videos.return_value.list
-            mock_request.return_value.execute.return_value = mock_response
-            mock_convert.return_value = date_time
+        # Mock the API response
+        mock_response = {
+            "items": [
+                {
+                    "id": youtube_video_id,
+                    "snippet": {"publishedAt": "2023-06-15T13:45:30Z"},
+                }
+            ]
+        }
+        http_response = Mock(
+            spec=requests.Response,
+            status_code=200,
+            content=orjson.dumps(mock_response),
+        )
 
-            # Call the function
-            result = lex_podcast.get_date_time(youtube_video_id, api_key)
+        # Call the function
+        self.mock_get.return_value = http_response
+        result = lex_podcast.get_date_time(youtube_video_id, api_key)
 
-            # Assert the result
-            expected = lex_podcast.convert_to_timestamp(date_time)
-            self.assertEqual(result, expected)
+        # Assert the result
+        expected = (datetime.date(2023, 6, 15), datetime.time(13, 45, 30))
+        self.assertEqual(result, expected)
 
-    @patch("googleapiclient.discovery.build")
-    def test_indexerror_handler_in_get_date_time(self, mock_build):
-        """Test get_date_time's IndexError handler."""
+    def test_get_date_time_with_an_unknown_video(self):
+        """Test get_date_time with a video the API doesn't return."""
         youtube_video_id = "abcde123456"
         api_key = "secretapikey"
 
         # Mock the API response
-        mock_response = {"items": []}
-
-        # Configure the mock object
-        mock_request = mock_build.return_value.videos.return_value.list
-        mock_request.return_value.execute.return_value = mock_response
+        http_response = Mock(
+            spec=requests.Response,
+            status_code=200,
+            content=orjson.dumps({"items": []}),
+        )
 
         # Call the function
+        self.mock_get.return_value = http_response
         result = lex_podcast.get_date_time(youtube_video_id, api_key)
 
         self.assertEqual(result, (None, None))
 
+    def test_get_date_time_with_api_error(self):
+        """Test get_date_time when the API call fails."""
+        http_response = Mock(spec=requests.Response, status_code=403)
+        http_response.raise_for_status.side_effect = requests.exceptions.HTTPError
+        self.mock_get.return_value = http_response
+        result = lex_podcast.get_date_time("abcde123456", "badapikey")
+
+        self.assertEqual(result, (None, None))
+
+    def test_get_upload_times_in_batches(self):
+        """Test get_upload_times requests up to 50 video IDs per call"""
+        video_ids = [f"video{number:06d}" for number in range(120)] + [None]
+
+        def list_videos(url, params, timeout):
+            items = [
+                {"id": video_id, "snippet": {"publishedAt": "2023-06-15T13:45:30Z"}}
+                for video_id in params["id"].split(",")
+            ]
+            return Mock(
+                spec=requests.Response,
+                status_code=200,
+                content=orjson.dumps({"items": items}),
+            )
+
+        self.mock_get.side_effect = list_videos
+        result = lex_podcast.get_upload_times(video_ids, "secretapikey")
+
+        self.assertEqual(self.mock_get.call_count, 3)
+        self.assertEqual(set(result), set(video_ids[:-1]))
+        self.assertEqual(
+            result["video000042"],
+            (datetime.date(2023, 6, 15), datetime.time(13, 45, 30)),
+        )
+
+        # The second lookup is served from the cache
+        self.mock_get.reset_mock(side_effect=True)
+        cached_result = lex_podcast.get_upload_times(video_ids, "secretapikey")
+
+        self.mock_get.assert_not_called()
+        self.assertEqual(cached_result, result)
+
+    def test_get_upload_times_with_malformed_items(self):
+        """Test get_upload_times skips only the malformed items of a batch"""
+        items = [
+            {"id": "video000001", "snippet": {"publishedAt": "2023-06-15T13:45:30Z"}},
+            {"id": "video000002", "snippet": {}},
+            {"id": "video000003", "snippet": {"publishedAt": "not a date"}},
+            {"snippet": {"publishedAt": "2023-06-15T13:45:30Z"}},
+        ]
+        self.mock_get.return_value = Mock(
+            spec=requests.Response,
+            status_code=200,
+            content=orjson.dumps({"items": items}),
+        )
+        video_ids = ["video000001", "video000002", "video000003", "video000004"]
+        result = lex_podcast.get_upload_times(video_ids, "secretapikey")
+
+        self.assertEqual(list(result), ["video000001"])
+        self.assertNotIn("maxResults", self.mock_get.call_args.kwargs["params"])
+
+    def test_parse_episode(self):
+        """Test parse_episode extracts the fields listed on the index page"""
+        html = f"""<div class="guest">
+            <div class="thumb-youtube"><img src="{self.podcast['thumbnail_url']}"></div>
+            <div class="vid-title"><a href="#">{self.podcast['title']}</a></div>
+            <div class="vid-person">{self.podcast['guest']}</div>
+            <div class="vid-materials">
+                <a href="{self.podcast['youtube_url']}">Video</a>
+                <a href="https://lexfridman.com/episode">Episode</a>
+            </div></div>"""
+        episode = lex_podcast.LexborHTMLParser(html).css_first("div.guest")
+        self.assertEqual(
+            lex_podcast.parse_episode(episode),
+            {
+                "title": self.podcast["title"],
+                "guest": self.podcast["guest"],
+                "youtube_url": self.podcast["youtube_url"],
+                "podcast_page": "https://lexfridman.com/episode",
+                "thumbnail_url": self.podcast["thumbnail_url"],
+            },
+        )
+        # An episode without the links is skipped
+        html = '<div class="guest"><div class="vid-title"></div></div>'
+        episode = lex_podcast.LexborHTMLParser(html).css_first("div.guest")
+        self.assertIsNone(lex_podcast.parse_episode(episode))
+
+    def test_get_data_with_unavailable_index_page(self):
+        """Test get_data when the index page responds with an error status"""
+        http_response = Mock(spec=requests.Response, status_code=503)
+        http_response.raise_for_status.side_effect = requests.exceptions.HTTPError
+        self.mock_get.return_value = http_response
+        self.assertIsNone(lex_podcast.get_data())
+
+    def test_add_upload_time(self):
+        """Test add_upload_time fills the date and time of a parsed record"""
+        youtube_url = self.podcast["youtube_url"]
+        upload_time = (datetime.date(2023, 6, 15), datetime.time(13, 45, 30))
+        upload_times = {lex_podcast.get_youtube_id(youtube_url): upload_time}
+        record = ("title", "guest", "", 1.0, youtube_url, None, None, None, None)
+        self.assertEqual(
+            lex_podcast.add_upload_time(record, upload_times),
+            record[:7] + upload_time,
+        )
+        # The records of the episodes that failed to parse stay empty
+        empty_record = tuple(None for _ in range(9))
+        self.assertEqual(
+            lex_podcast.add_upload_time(empty_record, upload_times), empty_record
+        )
+
+    def test_save_list_to_csv(self):
+        """Test save_list_to_csv writes every row once and skips empty records"""
+        rows = [
+            ("title", "guest", "", 1.0, "url", None, None, None, None),
+            tuple(None for _ in range(9)),
+            ["title 2", "guest 2", "", 2.0, "url 2", None, None, None, None],
+        ]
+        with tempfile.TemporaryDirectory() as directory:
+            file_name = os.path.join(directory, "podcasts")
+            lex_podcast.save_list_to_csv(iter(rows), file_name)
+            with open(f"{file_name}.csv", newline="", encoding="UTF-8") as file:
+                written = list(csv.reader(file, delimiter=";"))
+        self.assertEqual(len(written), 3)
+        self.assertEqual(written[1][0], "title")
+        self.assertEqual(written[2][0], "title 2")
+
     def test_get_duration_with_valid_url(self):
         """Test get_duration with a valid URL that returns an MP3 file."""
-        # create a mock HTTP response with self.fake_mp3 for requests.get to return
+        # create a mock HTTP response with self.fake_mp3 for the session to return
         http_response = Mock(
             spec=requests.Response, status_code=200, content=self.fake_mp3
         )
-        # patch requests.get to return the mock response when called with mp3_url
-        with patch(self.request_get, return_value=http_response):
-            duration = lex_podcast.get_duration("https://example.com/fake_audio.mp3")
-            self.assertEqual(duration, 12.49)
+        # make the session return the mock response when called with mp3_url
+        self.mock_get.return_value = http_response
+        duration = lex_podcast.get_duration("https://example.com/fake_audio.mp3")
+        self.assertEqual(duration, 12.49)
 
-    @patch(
-        "parsing.lex_podcast.requests.get",
-        side_effect=requests.exceptions.RequestException,
-    )
-    def test_get_duration_with_invalid_url(self, _):
+    def test_get_duration_with_partial_content(self):
+        """Test get_duration reads the duration from the head of an MP3 file."""
+        http_response = Mock(
+            spec=requests.Response, status_code=206, content=self.fake_mp3
+        )
+        self.mock_get.return_value = http_response
+        duration = lex_podcast.get_duration("https://example.com/fake_audio.mp3")
+        self.assertEqual(duration, 12.49)
+        self.assertEqual(
+            self.mock_get.call_args.kwargs["headers"],
+            {"Range": f"bytes=0-{lex_podcast.MP3_HEADER_BYTES - 1}"},
+        )
+
+    def test_get_duration_from_cache(self):
+        """Test get_duration returns a cached duration without a request."""
+        mp3_url = "https://example.com/fake_audio.mp3"
+        self.caches["durations"] = {mp3_url: 12.49}
+        duration = lex_podcast.get_duration(mp3_url)
+        self.assertEqual(duration, 12.49)
+        self.mock_get.assert_not_called()
+
+    def test_get_duration_with_large_id3_tag(self):
+        """Test get_duration requests the audio after an ID3v2 tag
+        that doesn't fit into the first range of an MP3 file."""
+        padding = 300 * 1024  # e.g. a cover art
+        tag_size = 35 + padding  # the tag of the fake MP3 file is 35 bytes
+        synchsafe_size = bytes((tag_size >> shift) & 0x7F for shift in (21, 14, 7, 0))
+        large_tag_mp3 = (
+            b"ID3\x04\x00\x00"
+            + synchsafe_size
+            + self.fake_mp3[10:45]
+            + bytes(padding)
+            + self.fake_mp3[45:]
+        )
+        audio_start = 10 + tag_size
+        self.assertEqual(lex_podcast.get_id3_size(large_tag_mp3), audio_start)
+
+        header_bytes = lex_podcast.MP3_HEADER_BYTES
+        self.mock_get.side_effect = [
+            Mock(
+                spec=requests.Response,
+                status_code=206,
+                content=large_tag_mp3[:header_bytes],
+            ),
+            Mock(
+                spec=requests.Response,
+                status_code=206,
+                content=large_tag_mp3[audio_start : audio_start + header_bytes],
+            ),
+        ]
+        duration = lex_podcast.get_duration("https://example.com/fake_audio.mp3")
+        self.assertEqual(duration, 12.49)
+        self.assertEqual(
+            self.mock_get.call_args.kwargs["headers"],
+            {"Range": f"bytes={audio_start}-{audio_start + header_bytes - 1}"},
+        )
+
+    def test_get_duration_without_header_frame(self):
+        """Test get_duration estimates the length of the whole file from
+        the partial content of an MP3 file without Xing/Info header."""
+        no_header_mp3 = self.fake_mp3.replace(b"Info", b"Junk")
+        bitrate = 56000  # bitrate of the first frame of the fake MP3 file
+        file_size = len(no_header_mp3) + bitrate // 8 * 600
+        http_response = Mock(
+            spec=requests.Response,
+            status_code=206,
+            content=no_header_mp3,
+            headers={"Content-Range": f"bytes 0-{len(no_header_mp3) - 1}/{file_size}"},
+        )
+        self.mock_get.return_value = http_response
+        duration = lex_podcast.get_duration("https://example.com/fake_audio.mp3")
+        self.assertAlmostEqual(duration, 600, delta=0.1)
+
+    def test_get_duration_with_invalid_url(self):
         """Test get_duration with an invalid URL that raises a RequestException."""
-        # with patch(self.request_get, side_effect=requests.exceptions.RequestException):
+        self.mock_get.side_effect = requests.exceptions.RequestException
         duration = lex_podcast.get_duration("https://example.com/non-existent.mp3")
         self.assertEqual(duration, 0.0)
 
     # Decorator to patch MutagenError with a MP3 file that has no metadata
     @patch(
-        "parsing.lex_podcast.mutagen.mp3.MP3",
+        "parsing.lex_podcast.MP3",
         side_effect=lex_podcast.mutagen.MutagenError,
     )
     def test_get_duration_with_no_metadata(self, _):
         """Test get_duration with an MP3 file that has no metadata."""
+        self.mock_get.return_value = Mock(
+            spec=requests.Response, status_code=200, content=self.fake_mp3
+        )
         duration = lex_podcast.get_duration(
             "https://example.com/no_metadata_audion.mp3"
         )
@@ -155,26 +398,46 @@ class TestLexPodcastParser(TestCase):
 
     def test_get_duration_with_a_wrong_extension(self):
         """Test get_duration with a url to a Wave file."""
-        duration = lex_podcast.get_duration("https://example.com/audio.wav")
-        self.assertEqual(
-            lex_podcast.logging.getLogger().getEffectiveLevel(),
-            lex_podcast.logging.ERROR,
-        )
+        with self.assertLogs(lex_podcast.logger, level="ERROR"):
+            duration = lex_podcast.get_duration("https://example.com/audio.wav")
         self.assertEqual(duration, 0.0)
 
     def test_check_url_response_with_valid_url(self):
         """Test check_url_response with a valid url"""
         http_response = Mock(spec=requests.Response, status_code=200)
-        with patch(self.request_get, return_value=http_response):
-            result = lex_podcast.check_url_response(self.podcast["audio_file_url"])
-            self.assertEqual(result, self.podcast["audio_file_url"])
+        self.mock_head.return_value = http_response
+        result = lex_podcast.check_url_response(self.podcast["audio_file_url"])
+        self.assertEqual(result, self.podcast["audio_file_url"])
 
     def test_check_url_response_with_invalid_url(self):
         """Test check_url_response with an invalid url"""
         http_response = Mock(spec=requests.Response, status_code=404)
-        with patch(self.request_get, return_value=http_response):
-            result = lex_podcast.check_url_response(self.podcast["audio_file_url"])
-            self.assertIsNone(result)
+        self.mock_head.return_value = http_response
+        result = lex_podcast.check_url_response(self.podcast["audio_file_url"])
+        self.assertIsNone(result)
+
+    def test_check_url_response_with_head_not_allowed(self):
+        """Test check_url_response falls back to GET if HEAD is refused"""
+        head_response = Mock(spec=requests.Response, status_code=405)
+        get_response = MagicMock(spec=requests.Response, status_code=200)
+        get_response.__enter__.return_value = get_response
+        self.mock_head.return_value = head_response
+        self.mock_get.return_value = get_response
+        result = lex_podcast.check_url_response(self.podcast["audio_file_url"])
+        self.assertEqual(result, self.podcast["audio_file_url"])
+        self.mock_get.assert_called_once()
+
+    def test_token_bucket_waits_when_empty(self):
+        """Test TokenBucket sleeps only once the burst is used up"""
+        with patch("parsing.lex_podcast.monotonic", return_value=100.0), patch(
+            "parsing.lex_podcast.sleep"
+        ) as mock_sleep:
+            bucket = lex_podcast.TokenBucket(rate=2, capacity=2)
+            bucket.acquire()
+            bucket.acquire()
+            mock_sleep.assert_not_called()
+            bucket.acquire()
+            mock_sleep.assert_called_once_with(0.5)
 
     def test_get_description_successful_request(self):
         """Test case for get_description with a successful request"""
@@ -188,10 +451,26 @@ class TestLexPodcastParser(TestCase):
             <p>Some more text</p>\
             <p>This is the description text of episode 1.</p></div></body></html>",
         )
-        with patch(self.request_get, return_value=mocked_response):
-            actual_output = lex_podcast.get_description(url)
+        self.mock_get.return_value = mocked_response
+        actual_output = lex_podcast.get_description(url)
         self.assertEqual(actual_output, expected_output)
 
+    def test_get_description_without_sponsor_plea(self):
+        """Test case for get_description cutting off the 'Please support' text"""
+        url = "https://example.com/podcast/episode-1"
+        mocked_response = Mock(
+            spec=requests.Response,
+            status_code=200,
+            content="<html><body><div class='entry-content'>\
+            <p>Some text</p>\
+            <p>Some more text</p>\
+            <p>Episode 1 description. Please support this podcast.</p>\
+            </div></body></html>",
+        )
+        self.mock_get.return_value = mocked_response
+        actual_output = lex_podcast.get_description(url)
+        self.assertEqual(actual_output, "Episode 1 description.")
+
     def test_get_description_request_exception(self):
         """Test case for get_description requests.exceptions.RequestException"""
         url = "https://example.com/podcast/episode-2"
@@ -200,8 +479,8 @@ class TestLexPodcastParser(TestCase):
             status_code=200,
             content="<html><body><div class='some-content'></div></body></html>",
         )
-        with patch(self.request_get, return_value=mocked_response):
-            actual_output = lex_podcast.get_description(url)
+        self.mock_get.return_value = mocked_response
+        actual_output = lex_podcast.get_description(url)
         self.assertEqual(actual_output, "")
 
     def test_get_description_no_description_text(self):
@@ -212,8 +491,8 @@ class TestLexPodcastParser(TestCase):
             status_code=200,
             content="<html><body><div class='entry-content'></div></body></html>",
         )
-        with patch(self.request_get, return_value=mocked_response):
-            actual_output = lex_podcast.get_description(url)
+        self.mock_get.return_value = mocked_response
+        actual_output = lex_podcast.get_description(url)
         self.assertEqual(actual_output, "")
 
     def test_get_description_with_timeout(self):
@@ -224,6 +503,6 @@ class TestLexPodcastParser(TestCase):
             status_code=408,
             ok=False
         )
-        with patch(self.request_get, return_value=mocked_response):
-            actual_output = lex_podcast.get_description(url)
+        self.mock_get.return_value = mocked_response
+        actual_output = lex_podcast.get_description(url)
         self.assertEqual(actual_output, "")